@@ -20,7 +20,13 @@ the original software.
 3. This notice may not be removed or altered from any source distribution.
 """
 
+import json
+import mmap
+import re
+from collections import OrderedDict, deque
+from io import StringIO
 from pathlib import Path
+from typing import NamedTuple
 from xml.etree.ElementTree import ElementTree
 
 class GeneOntology:
@@ -131,8 +137,17 @@ class GOManager:
     _GOs: dict[str, GeneOntology] = {}
     _verbose: bool = False
     _cache_part_of: dict[str, list[str]] = {}
-
-    def __init__(self, goOboFile: Path = None, verbose: bool = False):
+    _cache_ancestors: dict[str, frozenset[str]] = {}
+    # Lazy mode: byte offset of each [Term] stanza in the memory-mapped go.obo and the alt IDs pointing to it
+    _obo_map: mmap.mmap | None = None
+    _index_pattern = re.compile(rb'\n(?:(\[Term\])(?=\n)|\[|id: ([^\n]*)|alt_id: ([^\n]*))')
+    _index: dict[str, int] = {}
+    _alt_index: dict[str, str] = {}
+    _cache: OrderedDict[str, GeneOntology] = OrderedDict()
+    _cache_size: int = 0
+    _release: str = ""
+
+    def __init__(self, goOboFile: Path = None, verbose: bool = False, lazy: bool = False, cacheSize: int = 4096):
         self._verbose = verbose
 
         if goOboFile is None:
@@ -141,32 +156,65 @@ class GOManager:
         if not goOboFile.exists() or not goOboFile.is_file():
             raise RuntimeError(f"You must define an existing file for the GO database: {goOboFile}")
 
+        GOManager._release = self.releaseVersion(goOboFile)
+
+        if lazy:
+            if cacheSize < 1:
+                raise RuntimeError(f"The GO cache size must be at least 1: {cacheSize}")
+            self._indexGOs(goOboFile, cacheSize)
+            return
+
+        GOManager._obo_map = None
+        self._cache_ancestors.clear()
+
         print("Loading Gene Ontologies")
 
+        self._GOs.update(self._readGOs(goOboFile))
+
+        print("Finished loading Gene Ontologies")
+
+    @property
+    def release(self):
+        """The data-version of the loaded go.obo (or its hash when the header has none)."""
+        return self._release
+
+    @staticmethod
+    def releaseVersion(goOboFile: Path) -> str:
         with goOboFile.open(mode='r') as file:
             line = file.readline()
-            while line:
-                if line[:-1] == '[Term]':
-                    entry, line = self._loadGO(file)
-                    self._GOs[entry.accession] = entry
-                else:
-                    line = file.readline()
+            while line and line != "\n" and line[:1] != "[":  # The header ends at the first blank line or stanza
+                if line[:13] == "data-version:":
+                    return line[14:-1]
+                line = file.readline()
 
-        print("Finished loading Gene Ontologies")
+        from hashlib import file_digest
+        with goOboFile.open(mode='rb') as file:
+            return "sha256:" + file_digest(file, "sha256").hexdigest()  # Hashed in chunks, the file is never fully in memory
 
     def keys(self):
+        if self._obo_map is not None:
+            return self._index.keys()
         return self._GOs.keys()
 
     def items(self):
+        if self._obo_map is not None:
+            return ((accession, self[accession]) for accession in self._index)
         return self._GOs.items()
 
     def values(self):
+        if self._obo_map is not None:
+            return (self[accession] for accession in self._index)
         return self._GOs.values()
 
     def __iter__(self):
+        if self._obo_map is not None:
+            return iter(self._index)
         return iter(self._GOs)
 
     def __getitem__(self, accession: str) -> GeneOntology:
+        if self._obo_map is not None:
+            return self._getLazyGO(accession)
+
         try:
             return self._GOs[accession]
         except KeyError:
@@ -179,7 +227,7 @@ class GOManager:
 
     def part_of(self, accession: str) -> list[str]:
         if len(self._cache_part_of) == 0:
-            for goAcc, GO in self._GOs.items():
+            for goAcc, GO in self.items():
                 GOInfo = GO.info
                 if "Relationship" in GOInfo:
                     if "has_part" in GOInfo["Relationship"]:
@@ -194,6 +242,101 @@ class GOManager:
         else:
             return []
 
+    def ancestors(self, accession: str) -> frozenset[str]:
+        # Follows the same is_a and part_of relationships as GeneOntology.hasGOTree, the term itself is included
+        GO = self[accession]
+        if GO.accession not in self._cache_ancestors:
+            GOInfo = GO.info
+            parents = GOInfo.get("is a", []) + GOInfo.get("Relationship", {}).get("part_of", [])
+
+            ancestors = {GO.accession}
+            for parent in parents:
+                ancestors.update(self.ancestors(parent))
+            self._cache_ancestors[GO.accession] = frozenset(ancestors)
+        return self._cache_ancestors[GO.accession]
+
+    def _readGOs(self, goOboFile: Path) -> dict[str, GeneOntology]:
+        GOs: dict[str, GeneOntology] = {}
+
+        with goOboFile.open(mode='r') as file:
+            line = file.readline()
+            while line:
+                if line[:-1] == '[Term]':
+                    entry, line = self._loadGO(file)
+                    GOs[entry.accession] = entry
+                else:
+                    line = file.readline()
+
+        return GOs
+
+    def _indexGOs(self, goOboFile: Path, cacheSize: int):
+        print("Indexing Gene Ontologies")
+
+        with goOboFile.open(mode='rb') as file:
+            oboMap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._GOs.clear()
+        self._cache_part_of.clear()
+        self._cache_ancestors.clear()
+        self._index.clear()
+        self._alt_index.clear()
+        self._cache.clear()
+
+        # The scan runs in the compiled regex, Python only sees the stanza headers and the id/alt_id lines
+        # (a stanza header is always preceded by a newline, as the OBO header comes first)
+        inTerm = False
+        offset = 0
+        accession = ''
+        for match in self._index_pattern.finditer(oboMap):
+            if match.group(1) is not None:
+                inTerm = True
+                offset = match.end() + 1
+            elif match.group(2) is not None:
+                if inTerm:
+                    accession = match.group(2).decode()
+                    self._index[accession] = offset
+            elif match.group(3) is not None:
+                if inTerm:
+                    self._alt_index[match.group(3).decode()] = accession
+            else:
+                inTerm = False
+
+        # Shared with every GOManager() handle, like the term dictionary in the eager mode
+        GOManager._obo_map = oboMap
+        GOManager._cache_size = cacheSize
+
+        print("Finished indexing Gene Ontologies")
+
+    def _getLazyGO(self, accession: str) -> GeneOntology:
+        accession = self._alt_index.get(accession, accession)
+
+        if accession in self._GOs:  # Terms pinned by loadGOSlim
+            return self._GOs[accession]
+
+        if accession in self._cache:
+            self._cache.move_to_end(accession)
+            return self._cache[accession]
+
+        if accession not in self._index:
+            raise KeyError("Unknown GO Accession number")
+
+        oboMap = self._obo_map
+        if oboMap is None:
+            raise RuntimeError("The GO database was not indexed in the lazy mode")
+        offset = self._index[accession]
+        end = oboMap.find(b'\n\n', offset)
+        if end == -1:
+            end = len(oboMap) - 1
+        stanza = str(memoryview(oboMap)[offset:end + 1], encoding='utf-8')
+        if stanza[-1:] != "\n":
+            stanza += "\n"
+        entry, _ = self._loadGO(StringIO(stanza + "\n"))
+
+        self._cache[accession] = entry
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return entry
+
     def _loadGO(self, file: TextIOWrapper) -> tuple[GeneOntology, str]:
         current_line = file.readline()
         Accession = ''
@@ -283,7 +426,13 @@ class GOManager:
                     entry, line = self._loadGO(file)
 
                     accession = entry.accession
-                    if accession not in self._GOs:
+                    if self._obo_map is not None:
+                        accession = self._alt_index.get(accession, accession)
+                        if accession in self._index and accession not in self._GOs:
+                            # Pin the term so the subsets added below survive eviction from the cache
+                            self._GOs[accession] = self[accession]
+                            self._cache.pop(accession, None)
+                    elif accession not in self._GOs:
                         for goAcc, GO in self._GOs.items():
                             if 'Alt ID' in GO.info:
                                 if accession in GO.info['Alt ID']:
@@ -308,6 +457,167 @@ class GOManager:
 
         print(f"Finished loading Gene Ontology Slim: {goSlimFile}")
 
+    def slimTerms(self, goSlim: str, namespace: str = None) -> list[str]:
+        terms = []
+        for goAcc, GO in self.items():
+            if namespace is not None and namespace != GO.namespace:
+                continue
+            if "Subset" in GO.info:
+                if goSlim in GO.info["Subset"]:
+                    terms.append(goAcc)
+        return terms
+
+    def mapSlims(self, goAccs: list[str], slimAccs: list[str]) -> list[str]:
+        slims = []
+        for slimAcc in slimAccs:
+            for goAcc in goAccs:
+                if self[goAcc].hasGOTree(slimAcc):
+                    slims.append(slimAcc)
+                    break
+        return slims
+
+    def diffRelease(self, oldGoOboFile: Path) -> dict[str, list[str]]:
+        # Compares an older go.obo against the release currently loaded in the manager
+        if not oldGoOboFile.exists() or not oldGoOboFile.is_file():
+            raise RuntimeError(f"You must define an existing file for the GO database: {oldGoOboFile}")
+
+        print(f"Comparing Gene Ontology releases: {self.releaseVersion(oldGoOboFile)} -> {self._release}")
+
+        oldGOs = self._readGOs(oldGoOboFile)
+        newGOs = dict(self.items())
+
+        diff: dict[str, list[str]] = {
+            "Added": [],
+            "Obsoleted": [],
+            "Reparented": [],
+            "Alt ID": [],
+            "Affected": [],
+        }
+        changedAltIDs: set[str] = set()
+
+        for goAcc, GO in newGOs.items():
+            newInfo = GO.info
+            if goAcc not in oldGOs:
+                diff["Added"].append(goAcc)
+                changedAltIDs.update(newInfo.get("Alt ID", []))
+                continue
+
+            oldInfo = oldGOs[goAcc].info
+            if newInfo.get("Obsolete", False) and not oldInfo.get("Obsolete", False):
+                diff["Obsoleted"].append(goAcc)
+            if sorted(newInfo.get("is a", [])) != sorted(oldInfo.get("is a", [])) or \
+                    {rel: sorted(accs) for rel, accs in newInfo.get("Relationship", {}).items()} != \
+                    {rel: sorted(accs) for rel, accs in oldInfo.get("Relationship", {}).items()}:
+                diff["Reparented"].append(goAcc)
+            altIDs = set(newInfo.get("Alt ID", [])) ^ set(oldInfo.get("Alt ID", []))
+            if len(altIDs) > 0:
+                diff["Alt ID"].append(goAcc)
+                changedAltIDs.update(altIDs)
+
+        for goAcc in oldGOs:
+            if goAcc not in newGOs and goAcc not in changedAltIDs:  # Dropped without being merged into another term
+                diff["Obsoleted"].append(goAcc)
+
+        # Any term below a changed term may now reach a different set of ancestors, so follow the children in both releases
+        children: dict[str, set[str]] = {}
+        for GOs in [oldGOs, newGOs]:
+            for goAcc, GO in GOs.items():
+                GOInfo = GO.info
+                parents = list(GOInfo.get("is a", []))
+                for accs in GOInfo.get("Relationship", {}).values():
+                    parents += accs
+                for parent in parents:
+                    if parent not in children:
+                        children[parent] = set()
+                    children[parent].add(goAcc)
+
+        affected = set(diff["Added"]) | set(diff["Obsoleted"]) | set(diff["Reparented"]) | set(diff["Alt ID"]) | changedAltIDs
+        toVisit = list(affected)
+        while toVisit:
+            goAcc = toVisit.pop()
+            for child in children.get(goAcc, []):
+                if child not in affected:
+                    affected.add(child)
+                    toVisit.append(child)
+
+        # Proteins keep the GO ids as found in listUP.xml, which can be alt IDs of an affected term in either release
+        altIDs: set[str] = set()
+        for goAcc in affected:
+            for GOs in [oldGOs, newGOs]:
+                if goAcc in GOs:
+                    altIDs.update(GOs[goAcc].info.get("Alt ID", []))
+        affected |= altIDs
+        diff["Affected"] = sorted(affected)
+
+        print(f"Finished comparing Gene Ontology releases: {len(diff['Added'])} added, {len(diff['Obsoleted'])} obsoleted, {len(diff['Reparented'])} reparented, {len(diff['Alt ID'])} with new alt IDs, {len(affected)} affected")
+
+        return diff
+
+    def buildSlimMapping(
+            self,
+            proteinGOs: dict[str, list[str]],
+            goSlim: str,
+            slimsByNamespace: dict[str, list[str]],
+            termSlims: dict[str, list[str]] = None,
+            mappedProteins: dict[str, dict] = None,
+        ) -> dict:
+        # termSlims and mappedProteins can be shared between calls (e.g. across datasets) so each GO term and each protein is only mapped once
+        if termSlims is None:
+            termSlims = {}
+        if mappedProteins is None:
+            mappedProteins = {}
+        allSlims = [slimAcc for terms in slimsByNamespace.values() for slimAcc in terms]
+
+        mapping = {
+            "GO release": self._release,
+            "GO Slim": goSlim,
+            "Slim terms": {namespace: list(terms) for namespace, terms in slimsByNamespace.items()},
+            "Proteins": {},
+        }
+        for protAcc, goAccs in proteinGOs.items():
+            if protAcc in mappedProteins and mappedProteins[protAcc]["GO"] == list(goAccs):
+                mapping["Proteins"][protAcc] = mappedProteins[protAcc]
+                continue
+
+            reached = set()
+            for goAcc in goAccs:
+                if goAcc not in termSlims:
+                    termSlims[goAcc] = self.mapSlims([goAcc], allSlims)
+                reached.update(termSlims[goAcc])
+
+            mapping["Proteins"][protAcc] = {
+                "GO": list(goAccs),
+                "Slims": [slimAcc for slimAcc in allSlims if slimAcc in reached],
+            }
+            mappedProteins[protAcc] = mapping["Proteins"][protAcc]
+        return mapping
+
+    def updateSlimMapping(self, mapping: dict, diff: dict[str, list[str]]) -> list[str]:
+        proteins = mapping["Proteins"]
+
+        for namespace, storedSlims in mapping["Slim terms"].items():
+            currentSlims = self.slimTerms(mapping["GO Slim"], namespace)
+            addedSlims = [slimAcc for slimAcc in currentSlims if slimAcc not in storedSlims]
+            removedSlims = [slimAcc for slimAcc in storedSlims if slimAcc not in currentSlims]
+            if len(addedSlims) == 0 and len(removedSlims) == 0:
+                continue
+
+            for protein in proteins.values():
+                protein["Slims"] = [slimAcc for slimAcc in protein["Slims"] if slimAcc not in removedSlims]
+                protein["Slims"] += self.mapSlims(protein["GO"], addedSlims)
+            mapping["Slim terms"][namespace] = currentSlims
+
+        allSlims = [slimAcc for terms in mapping["Slim terms"].values() for slimAcc in terms]
+        affected = set(diff["Affected"])
+        recomputed = []
+        for protAcc, protein in proteins.items():
+            if affected.isdisjoint(protein["GO"]):
+                continue
+            protein["Slims"] = self.mapSlims(protein["GO"], allSlims)
+            recomputed.append(protAcc)
+
+        return recomputed
+
 class ProteinName:
     from xml.etree.ElementTree import Element
 
@@ -438,6 +748,13 @@ class DBReference:
 
         self._references[dbName].add_reference(xml)
 
+class ProteinRecord(NamedTuple):
+    # The parts of a Protein used by the analysis, small and picklable so it can be handed between processes
+    accession: str
+    name: str
+    gene_name: str
+    go: dict[str, list[str]]  # GO accession -> evidence codes
+
 class Protein:
     from xml.etree.ElementTree import Element
 
@@ -526,11 +843,23 @@ class Protein:
             return True
         return False
 
+    def record(self) -> ProteinRecord:
+        go: dict[str, list[str]] = {}
+        if "GO" in self._db_reference:
+            for goAcc, properties in self._db_reference["GO"].items():
+                go[goAcc] = [prop.attrib["value"] for prop in properties if prop.attrib.get("type") == "evidence"]
+
+        geneName = ""
+        if self._gene_name is not None:
+            geneName = self._gene_name.name
+        return ProteinRecord(self._accession, self._name, geneName, go)
+
 class ProteinManager:
 
-    _proteins: dict[str, Protein] = {}
+    _proteins: dict[str, Protein]
 
     def __init__(self, proteinXMLFile: Path = None, verbose: bool = False):
+        self._proteins = {}
 
         if not proteinXMLFile.exists() or not proteinXMLFile.is_file():
             raise RuntimeError(f"You must define an existing file for the result of the protein XML query: {proteinXMLFile}")
@@ -564,11 +893,223 @@ class ProteinManager:
                 pass # TODO: search in the alternative accessions
             raise KeyError(f"Unknown protein Accession number: {accession}")
 
+    @staticmethod
+    def iterProteins(proteinXMLFile: Path):
+        # Streams the entries of the protein XML file, dropping each one from the tree once it has been handed out, so memory does not grow with the file size
+        if not proteinXMLFile.exists() or not proteinXMLFile.is_file():
+            raise RuntimeError(f"You must define an existing file for the result of the protein XML query: {proteinXMLFile}")
+
+        from xml.etree.ElementTree import iterparse
+
+        root = None
+        for event, element in iterparse(proteinXMLFile, events=('start', 'end')):
+            if root is None:
+                root = element
+            elif event == 'end' and element.tag == '{http://uniprot.org/uniprot}entry':
+                yield Protein(element)
+                root.clear()  # Removes the finished entries (and anything before them) from the root
+
+def buildGOAnnotationMatrix(
+        GOM: GOManager,
+        proteins,  # Iterable of ProteinRecord, e.g. (protein.record() for protein in ProteinManager.iterProteins(...))
+        propagate: bool = False,
+        namespaces: list[str] = None,
+        evidences: list[str] = None,
+    ):
+    from array import array
+    import numpy
+    from scipy.sparse import csr_matrix
+
+    # The CSR arrays are filled one protein at a time, so only the non-zero entries are ever held in memory
+    rows: list[str] = []
+    columns: dict[str, int] = {}
+    indices = array('i')  # 32 bit column indices
+    indptr = array('q', [0])  # 64 bit row offsets, the number of annotations can outgrow 32 bits on propagated proteomes
+    resolved: dict[str, list[int]] = {}  # GO accession as found in the XML -> matrix columns
+
+    for record in proteins:
+        proteinColumns = set()
+        for goAcc, evidence in record.go.items():
+            if evidences is not None:
+                if not any(value in evidences for value in evidence):
+                    continue
+
+            if goAcc not in resolved:
+                terms = sorted(GOM.ancestors(goAcc)) if propagate else [GOM[goAcc].accession]
+                resolved[goAcc] = []
+                for term in terms:
+                    if namespaces is not None and GOM[term].namespace not in namespaces:
+                        continue
+                    if term not in columns:
+                        columns[term] = len(columns)
+                    resolved[goAcc].append(columns[term])
+            proteinColumns.update(resolved[goAcc])
+        indices.extend(sorted(proteinColumns))
+
+        rows.append(record.accession)
+        indptr.append(len(indices))
+
+    matrix = csr_matrix(
+        (numpy.ones(len(indices), dtype=numpy.int8), numpy.frombuffer(indices, dtype=numpy.int32), numpy.frombuffer(indptr, dtype=numpy.int64)),
+        shape=(len(rows), len(columns)),
+    )
+    return matrix, rows, list(columns)
+
+def saveGOAnnotationMatrix(outputFile: Path, matrix, rows: list[str], columns: list[str]):
+    from scipy.sparse import save_npz
+
+    save_npz(outputFile.with_suffix(".npz"), matrix)
+    with outputFile.with_name(f"{outputFile.stem}_rows.txt").open(mode='w') as file:
+        file.write("\n".join(rows) + "\n")
+    with outputFile.with_name(f"{outputFile.stem}_columns.txt").open(mode='w') as file:
+        file.write("\n".join(columns) + "\n")
+
+def _collectSlimProteins(slimMapping: dict, goNamespace: str, proteinNames: dict[str, tuple[str, str]]) -> dict[str, list[str]]:
+    considerGoAcc: dict[str, list[str]] = {}
+    for GOAcc in slimMapping["Slim terms"][goNamespace]:
+        considerGoAcc[GOAcc] = []
+
+    for protAcc in proteinNames:
+        for GOAcc in slimMapping["Proteins"][protAcc]["Slims"]:
+            if GOAcc in considerGoAcc:
+                considerGoAcc[GOAcc].append(protAcc)
+
+    removeAcc = ["GO:0008150", "GO:0003674", "GO:0005575"]  # These are the root accessions
+    for GOAcc, protList in considerGoAcc.items():
+        count = len(protList)
+        if count == 0:
+            removeAcc.append(GOAcc)
+    for GOAcc in removeAcc:
+        if GOAcc in considerGoAcc:
+            del considerGoAcc[GOAcc]
+
+    return considerGoAcc
+
+def _fillSlimSheet(info_sheet, GOM: GOManager, proteinNames: dict[str, tuple[str, str]], considerGoAcc: dict[str, list[str]]):
+    info_sheet.cell(row=1, column=1, value="GO Accession")
+    info_sheet.cell(row=1, column=2, value="GO Name")
+    info_sheet.cell(row=1, column=3, value="Protein Count")
+    info_sheet.cell(row=1, column=4, value="Protein Accession")
+    info_sheet.cell(row=1, column=5, value="Protein Entry Name")
+    info_sheet.cell(row=1, column=6, value="Gene Name")
+
+    current_row = 2
+    for GOAcc, protList in considerGoAcc.items():
+        info_sheet.cell(row=current_row, column=1, value=GOAcc)
+        info_sheet.cell(row=current_row, column=2, value=GOM[GOAcc].name)
+        info_sheet.cell(row=current_row, column=3, value=len(protList))
+
+        offset = 0
+        for protAcc in protList:
+            info_sheet.cell(row=current_row + offset, column=4, value=protAcc)
+            info_sheet.cell(row=current_row + offset, column=5, value=proteinNames[protAcc][0])
+            info_sheet.cell(row=current_row + offset, column=6, value=proteinNames[protAcc][1])
+            offset += 1
+
+        current_row += max(1, len(protList))
+
+def _readProteinRecords(proteinXMLFile: Path) -> list[ProteinRecord]:
+    # Only the records leave this function, the parsed XML tree is dropped with the ProteinManager
+    PM = ProteinManager(proteinXMLFile = proteinXMLFile)
+    return [protein.record() for protein in PM.values()]
+
+class _SheetData:
+    # The cells of a worksheet as plain values, so the workbook can be built and saved by another process
+
+    title: str
+    cells: list[tuple[int, int, object, str]]
+
+    def __init__(self, title: str):
+        self.title = title
+        self.cells = []
+
+    def cell(self, row: int, column: int, value = None, number_format: str = None):
+        self.cells.append((row, column, value, number_format))
+
+def _saveWorkbook(outputFile: Path, sheets: list[_SheetData]):
+    from openpyxl import Workbook
+
+    wb = Workbook()
+    for index, sheetData in enumerate(sheets):
+        sheet = wb.active if index == 0 else wb.create_sheet()
+        sheet.title = sheetData.title
+        for row, column, value, number_format in sheetData.cells:
+            cell = sheet.cell(row=row, column=column, value=value)
+            if number_format is not None:
+                cell.number_format = number_format
+    wb.save(outputFile)
+
+def _processPool():
+    # spawn instead of fork, so the worker does not inherit a copy of the loaded GO database
+    import multiprocessing
+
+    return multiprocessing.get_context("spawn").Pool(processes=1)
+
+def _startProteinPipeline(pool, basePaths: list[Path], ahead: int = 1):
+    # Parses the protein XML files in the worker pool, at most `ahead` datasets in front of the one being analysed.
+    # The first files are submitted right away, so they are parsed while the GO database is loaded.
+    paths = iter(basePaths)
+    pending = deque()
+
+    def submitNext():
+        basePath = next(paths, None)
+        if basePath is not None:
+            pending.append((basePath, pool.apply_async(_readProteinRecords, (basePath/"listUP.xml",))))
+
+    for _ in range(ahead):
+        submitNext()
+
+    def consume():
+        while pending:
+            basePath, result = pending.popleft()
+            records = result.get()
+            submitNext()
+            yield basePath, records
+
+    return consume()
+
+class _WorkbookWriter:
+    # Builds and saves the xlsx reports, in a separate process when pipelined, with at most maxPending reports queued
+
+    def __init__(self, pipelined: bool, maxPending: int = 2):
+        self._pool = None
+        self._pending = deque()
+        self._maxPending = maxPending
+        if pipelined:
+            self._pool = _processPool()
+
+    def save(self, outputFile: Path, sheets: list[_SheetData]):
+        if self._pool is None:
+            _saveWorkbook(outputFile, sheets)
+            return
+
+        while len(self._pending) >= self._maxPending:
+            self._pending.popleft().get()
+        self._pending.append(self._pool.apply_async(_saveWorkbook, (outputFile, sheets)))
+
+    def wait(self):
+        # Re-raises the first error of the queued reports
+        while self._pending:
+            self._pending.popleft().get()
+
+    def shutdown(self):
+        # The reports already queued belong to finished datasets, so they are still written
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+
 def script_main(
         goOboPath: Path,
         dataPaths: list[Path],
         goSlim: str = "goslim_generic",
         goNamespace: str = 'A',  # Options: B, M, C, A, None
+        previousGoOboPath: Path = None,
+        combinedPath: Path = None,
+        annotationMatrix: bool = False,
+        propagate: bool = False,
+        evidences: list[str] = None,
+        pipelined: bool = False,
+        matrixOnly: bool = False,
     ):
     if goNamespace not in ['B', 'M', 'C', 'A', None]:
         raise RuntimeError(f'Invalid GO Namespace filter selected: {goNamespace}')
@@ -579,38 +1120,78 @@ def script_main(
     elif goNamespace != 'A':
         namespaces_to_run = [goNamespace]
 
-    GOM = GOManager(goOboFile = goOboPath/"go.obo")
-
-    for basePath in dataPaths:
-        PM = ProteinManager(proteinXMLFile = basePath/"listUP.xml")
-
-        from openpyxl import Workbook
-        wb = Workbook()
+    namespace_names = {
+        "M": "molecular_function",
+        "B": "biological_process",
+        "C": "cellular_component",
+    }
+
+    matrixNamespaces = None  # The annotation matrix keeps every namespace unless a single one is selected
+    if goNamespace not in ['A', None]:
+        matrixNamespaces = [namespace_names[goNamespace]]
+
+    if matrixOnly:
+        # The protein XML files are streamed straight into the matrices, no ProteinManager is built
+        GOM = GOManager(goOboFile = goOboPath/"go.obo")
+        for basePath in dataPaths:
+            matrix, rows, columns = buildGOAnnotationMatrix(
+                GOM,
+                (protein.record() for protein in ProteinManager.iterProteins(basePath/"listUP.xml")),
+                propagate = propagate,
+                namespaces = matrixNamespaces,
+                evidences = evidences,
+            )
+            saveGOAnnotationMatrix(basePath/"GOAnnotations.npz", matrix, rows, columns)
+        return
+
+    # In the pipelined mode the protein XML files are parsed and the workbooks are saved in their own processes,
+    # overlapping with the loading of the GO database and the mapping done here
+    parserPool = None
+    if pipelined:
+        parserPool = _processPool()
+        proteinRecords = _startProteinPipeline(parserPool, dataPaths)
+    else:
+        proteinRecords = ((basePath, _readProteinRecords(basePath/"listUP.xml")) for basePath in dataPaths)
+    writer = _WorkbookWriter(pipelined)
+
+    try:
+        GOM = GOManager(goOboFile = goOboPath/"go.obo")
+
+        releaseDiff = None
+        previousRelease = None
+        if previousGoOboPath is not None:
+            previousRelease = GOManager.releaseVersion(previousGoOboPath/"go.obo")
+            releaseDiff = GOM.diffRelease(previousGoOboPath/"go.obo")
+
+        namespaces = [namespace_names[goNS] for goNS in namespaces_to_run]
+        slimsByNamespace = {namespace: GOM.slimTerms(goSlim, namespace) for namespace in namespaces}
+        termSlims: dict[str, list[str]] = {}
+        mappedProteins: dict[str, dict] = {}
+        datasets: list[tuple[Path, dict[str, tuple[str, str]], dict]] = []  # Only kept for the combined report
+
+        for basePath, records in proteinRecords:
+            info_sheet = _SheetData("Info")
+
+            info_sheet.cell(row=1, column=1, value="ID")
+            info_sheet.cell(row=1, column=2, value="Accession")
+            info_sheet.cell(row=1, column=3, value="Name")
+            info_sheet.cell(row=1, column=4, value="Gene Name")
+            info_sheet.cell(row=1, column=5, value="Molecular Function")
+            info_sheet.cell(row=1, column=6, value="Biological Process")
+            info_sheet.cell(row=1, column=7, value="Cellular Component")
 
-        info_sheet = wb.active
-        info_sheet.title = "Info"
-
-        info_sheet.cell(row=1, column=1, value="ID")
-        info_sheet.cell(row=1, column=2, value="Accession")
-        info_sheet.cell(row=1, column=3, value="Name")
-        info_sheet.cell(row=1, column=4, value="Gene Name")
-        info_sheet.cell(row=1, column=5, value="Molecular Function")
-        info_sheet.cell(row=1, column=6, value="Biological Process")
-        info_sheet.cell(row=1, column=7, value="Cellular Component")
-
-        current_row = 2
-        for protAcc in PM:
-            info_sheet.cell(row = current_row, column=1, value=protAcc)
-            info_sheet.cell(row = current_row, column=2, value=protAcc)
-            info_sheet.cell(row = current_row, column=3, value=PM[protAcc].name)
-            info_sheet.cell(row = current_row, column=4, value=PM[protAcc].gene_name)
+            current_row = 2
+            for record in records:
+                info_sheet.cell(row = current_row, column=1, value=record.accession)
+                info_sheet.cell(row = current_row, column=2, value=record.accession)
+                info_sheet.cell(row = current_row, column=3, value=record.name)
+                info_sheet.cell(row = current_row, column=4, value=record.gene_name)
 
-            m_counter = 0
-            b_counter = 0
-            c_counter = 0
+                m_counter = 0
+                b_counter = 0
+                c_counter = 0
 
-            if "GO" in PM[protAcc].db_references:
-                for goAcc in PM[protAcc].db_references["GO"]:
+                for goAcc in record.go:
                     goEntry = GOM[goAcc]
                     if goEntry.namespace == "molecular_function":
                         info_sheet.cell(row = current_row + m_counter, column = 5, value=goEntry.name)
@@ -624,76 +1205,116 @@ def script_main(
                     else:
                         print(f"Unknown namespace: {goEntry.namespace}")
 
-            current_row += max(1, m_counter, b_counter, c_counter)
-
-        wb.save(basePath/"SummaryGO.xlsx")
-
-        for goNS in namespaces_to_run:
-            if goNS == "M":
-                goNS = "molecular_function"
-            elif goNS == "B":
-                goNS = "biological_process"
-            elif goNS == "C":
-                goNS = "cellular_component"
-
-            considerGoAcc: dict[str, list[str]] = {}
-            for GOAcc in GOM:
-                if goNS != GOM[GOAcc].namespace:
-                    continue
-                if "Subset" in GOM[GOAcc].info:
-                    if goSlim in GOM[GOAcc].info["Subset"]:
-                        considerGoAcc[GOAcc] = []
-
-            for protAcc in PM:
-                for GOAcc in considerGoAcc:
-                    foundGO = False
-
-                    if "GO" in PM[protAcc].db_references:
-                        for entry in PM[protAcc].db_references["GO"]:
-                            if GOM[entry].hasGOTree(GOAcc):
-                                foundGO = True
-                                break
-
-                    if foundGO:
-                        considerGoAcc[GOAcc].append(protAcc)
-
-            removeAcc = ["GO:0008150", "GO:0003674", "GO:0005575"]  # These are the root accessions
-            for GOAcc, protList in considerGoAcc.items():
-                count = len(protList)
-                if count == 0:
-                    removeAcc.append(GOAcc)
-            for GOAcc in removeAcc:
-                if GOAcc in considerGoAcc:
-                    del considerGoAcc[GOAcc]
-
-            wb = Workbook()
-
-            info_sheet = wb.active
-            info_sheet.title = "Info"
-
-            info_sheet.cell(row=1, column=1, value="GO Accession")
-            info_sheet.cell(row=1, column=2, value="GO Name")
-            info_sheet.cell(row=1, column=3, value="Protein Count")
-            info_sheet.cell(row=1, column=4, value="Protein Accession")
-            info_sheet.cell(row=1, column=5, value="Protein Entry Name")
-            info_sheet.cell(row=1, column=6, value="Gene Name")
-
-            current_row = 2
-            for GOAcc, protList in considerGoAcc.items():
-                info_sheet.cell(row=current_row, column=1, value=GOAcc)
-                info_sheet.cell(row=current_row, column=2, value=GOM[GOAcc].name)
-                info_sheet.cell(row=current_row, column=3, value=len(protList))
-
-                offset = 0
-                for protAcc in protList:
-                    info_sheet.cell(row=current_row + offset, column=4, value=protAcc)
-                    info_sheet.cell(row=current_row + offset, column=5, value=PM[protAcc].name)
-                    info_sheet.cell(row=current_row + offset, column=6, value=PM[protAcc].gene_name)
-                    offset += 1
-
-                current_row += max(1, len(protList))
-
-            wb.save(basePath/f"Summary_{goNS}.xlsx")
+                current_row += max(1, m_counter, b_counter, c_counter)
+
+            writer.save(basePath/"SummaryGO.xlsx", [info_sheet])
+
+            if annotationMatrix:
+                matrix, rows, columns = buildGOAnnotationMatrix(
+                    GOM,
+                    records,
+                    propagate = propagate,
+                    namespaces = matrixNamespaces,
+                    evidences = evidences,
+                )
+                saveGOAnnotationMatrix(basePath/"GOAnnotations.npz", matrix, rows, columns)
+
+            proteinGOs: dict[str, list[str]] = {record.accession: list(record.go) for record in records}
+
+            # The per-protein slim mapping is stored next to the data, so a new GO release only recomputes the proteins it touches
+            mappingFile = basePath/"SlimMapping.json"
+            slimMapping = None
+            storedMapping = False
+            if mappingFile.exists() and mappingFile.is_file():
+                with mappingFile.open(mode='r') as file:
+                    slimMapping = json.load(file)
+                if slimMapping["GO Slim"] != goSlim or any(namespace not in slimMapping["Slim terms"] for namespace in namespaces) or \
+                        {protAcc: protein["GO"] for protAcc, protein in slimMapping["Proteins"].items()} != proteinGOs:
+                    print(f"The stored slim mapping does not match the current analysis, recomputing it: {mappingFile}")
+                    slimMapping = None
+                elif slimMapping.get("GO release") == GOM.release:
+                    if any(slimMapping["Slim terms"][namespace] != slimsByNamespace[namespace] for namespace in namespaces):
+                        print(f"The stored slim mapping has different slim terms for GO release {GOM.release}, recomputing it: {mappingFile}")
+                        slimMapping = None
+                    else:
+                        print(f"The stored slim mapping is already at GO release {GOM.release}, reusing it: {mappingFile}")
+                        storedMapping = True
+                elif releaseDiff is not None and slimMapping.get("GO release") == previousRelease:
+                    recomputed = GOM.updateSlimMapping(slimMapping, releaseDiff)
+                    slimMapping["GO release"] = GOM.release
+                    print(f"Recomputed the slim mapping of {len(recomputed)} out of {len(proteinGOs)} proteins")
+                else:
+                    print(f"The stored slim mapping was built with GO release {slimMapping.get('GO release')}, recomputing it: {mappingFile}")
+                    slimMapping = None
+            if slimMapping is None:
+                slimMapping = GOM.buildSlimMapping(proteinGOs, goSlim, slimsByNamespace, termSlims, mappedProteins)
+            if not storedMapping:
+                with mappingFile.open(mode='w') as file:
+                    json.dump(slimMapping, file, indent=1)
+
+            # Only the names are needed for the slim reports
+            proteinNames = {record.accession: (record.name, record.gene_name) for record in records}
+
+            if combinedPath is not None:
+                datasets.append((basePath, proteinNames, slimMapping))
+                continue
+
+            for goNS in namespaces:
+                considerGoAcc = _collectSlimProteins(slimMapping, goNS, proteinNames)
+
+                info_sheet = _SheetData("Info")
+                _fillSlimSheet(info_sheet, GOM, proteinNames, considerGoAcc)
+
+                writer.save(basePath/f"Summary_{goNS}.xlsx", [info_sheet])
+
+        if combinedPath is not None:
+            for goNS in namespaces:
+                datasetSlims = [_collectSlimProteins(slimMapping, goNS, proteinNames) for _, proteinNames, slimMapping in datasets]
+
+                matrix_sheet = _SheetData("Matrix")
+
+                matrix_sheet.cell(row=1, column=1, value="GO Accession")
+                matrix_sheet.cell(row=1, column=2, value="GO Name")
+                for index in range(len(datasets)):  # The paths of the datasets are listed in the Datasets sheet
+                    matrix_sheet.cell(row=1, column=3 + 2*index, value=f"Dataset {index + 1} Count")
+                    matrix_sheet.cell(row=1, column=4 + 2*index, value=f"Dataset {index + 1} Percentage")
+
+                current_row = 2
+                for GOAcc in slimsByNamespace[goNS]:
+                    if all(GOAcc not in considerGoAcc for considerGoAcc in datasetSlims):
+                        continue
+
+                    matrix_sheet.cell(row=current_row, column=1, value=GOAcc)
+                    matrix_sheet.cell(row=current_row, column=2, value=GOM[GOAcc].name)
+                    for index, ((_, proteinNames, _), considerGoAcc) in enumerate(zip(datasets, datasetSlims)):
+                        count = len(considerGoAcc.get(GOAcc, []))
+                        matrix_sheet.cell(row=current_row, column=3 + 2*index, value=count)
+                        matrix_sheet.cell(row=current_row, column=4 + 2*index, value=count/max(1, len(proteinNames)), number_format='0.00%')
+                    current_row += 1
+
+                datasets_sheet = _SheetData("Datasets")
+                datasets_sheet.cell(row=1, column=1, value="Dataset")
+                datasets_sheet.cell(row=1, column=2, value="Path")
+                datasets_sheet.cell(row=1, column=3, value="Protein Count")
+                dataset_sheets = []
+                for index, ((basePath, proteinNames, _), considerGoAcc) in enumerate(zip(datasets, datasetSlims)):
+                    datasets_sheet.cell(row=2 + index, column=1, value=f"Dataset {index + 1}")
+                    datasets_sheet.cell(row=2 + index, column=2, value=str(basePath))
+                    datasets_sheet.cell(row=2 + index, column=3, value=len(proteinNames))
+
+                    dataset_sheets.append(_SheetData(f"Dataset {index + 1}"))
+                    _fillSlimSheet(dataset_sheets[-1], GOM, proteinNames, considerGoAcc)
+
+                writer.save(combinedPath/f"SummaryMatrix_{goNS}.xlsx", [matrix_sheet, datasets_sheet] + dataset_sheets)
+
+        writer.wait()
+    finally:
+        # Also reached when the analysis fails, so no worker is left holding a parsed dataset
+        proteinRecords.close()
+        if parserPool is not None:
+            parserPool.terminate()  # Stops a parse still running for a dataset that will not be analysed
+            parserPool.join()
+        writer.shutdown()
 
 if __name__ == "__main__":
     import argparse
@@ -718,9 +1339,26 @@ if __name__ == "__main__":
         '--dataPath',
         metavar = 'PATH',
         type = Path,
-        help = 'Path to the directory cotaining listUP.xml input data file and where to store the output',  # TODO: add possibility to give multiple
+        nargs = '+',
+        help = 'Path to the directory cotaining listUP.xml input data file and where to store the output, several directories can be given',
         required = True,
-        dest = 'dataPath',
+        dest = 'dataPaths',
+    )
+    parser.add_argument(
+        '-c',
+        '--combinedPath',
+        metavar = 'PATH',
+        type = Path,
+        help = 'Path to the directory where to store a single GO Slim x dataset matrix for all the given data directories, instead of one summary per directory',
+        dest = 'combinedPath',
+    )
+    parser.add_argument(
+        '-p',
+        '--previousGoOboPath',
+        metavar = 'PATH',
+        type = Path,
+        help = 'Path to the directory cotaining the go.obo file of the previous GO release; only the stored slim mappings affected by the changes between releases are recomputed',
+        dest = 'previousGoOboPath',
     )
     parser.add_argument(
         '-n',
@@ -732,9 +1370,51 @@ if __name__ == "__main__":
         default = 'A',
         dest = 'goNamespace',
     )
+    parser.add_argument(
+        '-m',
+        '--annotationMatrix',
+        help = 'Also save the GO annotations of the proteins as a sparse protein x GO term matrix (GOAnnotations.npz, with the row and column accessions in GOAnnotations_rows.txt and GOAnnotations_columns.txt), filtered by the selected namespace',
+        action = 'store_true',
+        dest = 'annotationMatrix',
+    )
+    parser.add_argument(
+        '-o',
+        '--matrixOnly',
+        help = 'Only save the sparse protein x GO term matrix, streaming listUP.xml so that memory does not grow with the number of proteins (no xlsx summaries are written, so it can not be combined with -c, -p or -t)',
+        action = 'store_true',
+        dest = 'matrixOnly',
+    )
+    parser.add_argument(
+        '-a',
+        '--propagate',
+        help = 'Propagate the annotations of the protein x GO term matrix to all the ancestor terms (requires -m or -o)',
+        action = 'store_true',
+        dest = 'propagate',
+    )
+    parser.add_argument(
+        '-e',
+        '--evidence',
+        metavar = 'CODE',
+        type = str,
+        nargs = '+',
+        help = 'Only keep the annotations of the protein x GO term matrix with one of these exact evidence codes (e.g. ECO:0000269), requires -m or -o',
+        dest = 'evidences',
+    )
+    parser.add_argument(
+        '-t',
+        '--pipelined',
+        help = 'Parse the listUP.xml files and save the xlsx reports in separate processes, overlapping with the loading of the GO database and with the mapping of the GO Slims',
+        action = 'store_true',
+        dest = 'pipelined',
+    )
 
     args = parser.parse_args()
 
+    if args.matrixOnly and (args.combinedPath is not None or args.previousGoOboPath is not None or args.pipelined):
+        parser.error("-o/--matrixOnly only saves the annotation matrix and can not be combined with -c/--combinedPath, -p/--previousGoOboPath or -t/--pipelined")
+    if (args.propagate or args.evidences is not None) and not (args.annotationMatrix or args.matrixOnly):
+        parser.error("-a/--propagate and -e/--evidence only apply to the annotation matrix, which is saved with -m/--annotationMatrix or -o/--matrixOnly")
+
     goOboPath: Path = args.goOboPath
     if not goOboPath.exists() or not goOboPath.is_dir():
         raise RuntimeError("You must define an existing Path for goOboPath")
@@ -742,15 +1422,35 @@ if __name__ == "__main__":
         raise RuntimeError("You must specify a path for goOboPath which contains the go.obo file (download from https://geneontology.org/)")
     goOboPath = goOboPath.absolute()
 
-    dataPath: Path = args.dataPath
-    if not dataPath.exists() or not dataPath.is_dir():
-        raise RuntimeError("You must define an existing Path for dataPath")
-    if not (dataPath/'listUP.xml').exists() or not (dataPath/'listUP.xml').is_file():
-        raise RuntimeError("You must specify a path for dataPath which contains the listUP.xml file (the results of a query to https://www.uniprot.org/)")
-    dataPath = dataPath.absolute()
+    previousGoOboPath: Path = args.previousGoOboPath
+    if previousGoOboPath is not None:
+        if not (previousGoOboPath/'go.obo').exists() or not (previousGoOboPath/'go.obo').is_file():
+            raise RuntimeError("You must specify a path for previousGoOboPath which contains the go.obo file of the previous GO release")
+        previousGoOboPath = previousGoOboPath.absolute()
+
+    dataPaths: list[Path] = []
+    for dataPath in args.dataPaths:
+        if not dataPath.exists() or not dataPath.is_dir():
+            raise RuntimeError(f"You must define an existing Path for dataPath: {dataPath}")
+        if not (dataPath/'listUP.xml').exists() or not (dataPath/'listUP.xml').is_file():
+            raise RuntimeError(f"You must specify a path for dataPath which contains the listUP.xml file (the results of a query to https://www.uniprot.org/): {dataPath}")
+        dataPaths.append(dataPath.absolute())
+
+    combinedPath: Path = args.combinedPath
+    if combinedPath is not None:
+        if not combinedPath.exists() or not combinedPath.is_dir():
+            raise RuntimeError("You must define an existing Path for combinedPath")
+        combinedPath = combinedPath.absolute()
 
     script_main(
         goOboPath = goOboPath,
-        dataPaths = [dataPath],
+        dataPaths = dataPaths,
         goNamespace = args.goNamespace,
+        previousGoOboPath = previousGoOboPath,
+        combinedPath = combinedPath,
+        annotationMatrix = args.annotationMatrix,
+        propagate = args.propagate,
+        evidences = args.evidences,
+        pipelined = args.pipelined,
+        matrixOnly = args.matrixOnly,
         )
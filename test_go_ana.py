@@ -0,0 +1,114 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+
+"""
+Checks that updating a stored GO Slim mapping to a new GO release gives the same result as building it again.
+
+Run with: python -m unittest test_go_ana
+"""
+
+import tempfile
+import unittest
+from pathlib import Path
+
+from go_ana import GOManager
+
+SLIM = "goslim_generic"
+NAMESPACE = "biological_process"
+
+# Terms of the base release: accession -> (is_a parents, alt IDs, in the slim)
+BASE_TERMS: dict[str, tuple[list[str], list[str], bool]] = {
+    "GO:0008150": ([], [], True),
+    "GO:0000001": (["GO:0008150"], ["GO:0000099"], True),
+    "GO:0000002": (["GO:0008150"], [], True),
+    "GO:0000003": (["GO:0008150"], [], True),
+    "GO:0000004": (["GO:0000002"], ["GO:0000098"], False),
+    "GO:0000005": (["GO:0000002"], [], False),
+    "GO:0000006": (["GO:0000003"], [], False),
+}
+
+PROTEIN_GOS: dict[str, list[str]] = {
+    "P1": ["GO:0000004"],
+    "P2": ["GO:0000005"],
+    "P3": ["GO:0000099"],  # Alt ID of GO:0000001
+    "P4": ["GO:0000098"],  # Alt ID of GO:0000004
+    "P5": ["GO:0000006"],
+    "P6": ["GO:0000003", "GO:0000005"],
+}
+
+def writeObo(path: Path, release: str, terms: dict[str, tuple[list[str], list[str], bool]]):
+    with path.open(mode='w') as file:
+        file.write(f"format-version: 1.2\ndata-version: {release}\n\n")
+        for goAcc, (parents, altIDs, inSlim) in terms.items():
+            file.write(f"[Term]\nid: {goAcc}\nname: term {goAcc}\nnamespace: {NAMESPACE}\n")
+            for altID in altIDs:
+                file.write(f"alt_id: {altID}\n")
+            if inSlim:
+                file.write(f"subset: {SLIM}\n")
+            for parent in parents:
+                file.write(f"is_a: {parent}\n")
+            file.write("\n")
+
+def loadRelease(goOboFile: Path) -> GOManager:
+    # The loaded terms are shared by all the managers, so the previous release is dropped first
+    # pylint: disable=protected-access
+    GOManager._GOs.clear()
+    GOManager._cache_part_of.clear()
+    GOManager._cache_ancestors.clear()
+    return GOManager(goOboFile = goOboFile)
+
+class SlimMappingUpdateTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.path = Path(self._directory.name)
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def buildMapping(self, GOM: GOManager) -> dict:
+        return GOM.buildSlimMapping(PROTEIN_GOS, SLIM, {NAMESPACE: GOM.slimTerms(SLIM, NAMESPACE)})
+
+    def checkUpdate(self, newTerms: dict[str, tuple[list[str], list[str], bool]]) -> dict:
+        oldGoOboFile = self.path/"old.obo"
+        newGoOboFile = self.path/"new.obo"
+        writeObo(oldGoOboFile, "releases/old", BASE_TERMS)
+        writeObo(newGoOboFile, "releases/new", newTerms)
+
+        mapping = self.buildMapping(loadRelease(oldGoOboFile))
+
+        GOM = loadRelease(newGoOboFile)
+        GOM.updateSlimMapping(mapping, GOM.diffRelease(oldGoOboFile))
+        mapping["GO release"] = GOM.release
+
+        rebuilt = self.buildMapping(GOM)
+        self.assertEqual(mapping["Proteins"], rebuilt["Proteins"])
+        self.assertEqual(mapping, rebuilt)
+        return rebuilt
+
+    def testReparent(self):
+        newTerms = dict(BASE_TERMS)
+        newTerms["GO:0000004"] = (["GO:0000003"], ["GO:0000098"], False)
+        rebuilt = self.checkUpdate(newTerms)
+        self.assertEqual(rebuilt["Proteins"]["P1"]["Slims"], ["GO:0008150", "GO:0000003"])
+
+    def testMerge(self):
+        newTerms = dict(BASE_TERMS)
+        del newTerms["GO:0000005"]
+        newTerms["GO:0000001"] = (["GO:0008150"], ["GO:0000099", "GO:0000005"], True)
+        rebuilt = self.checkUpdate(newTerms)
+        self.assertEqual(rebuilt["Proteins"]["P2"]["Slims"], ["GO:0008150", "GO:0000001"])
+
+    def testAltIDOfReparentedTerm(self):
+        newTerms = dict(BASE_TERMS)
+        newTerms["GO:0000001"] = (["GO:0008150", "GO:0000003"], ["GO:0000099"], True)
+        rebuilt = self.checkUpdate(newTerms)
+        self.assertEqual(rebuilt["Proteins"]["P3"]["Slims"], ["GO:0008150", "GO:0000001", "GO:0000003"])
+
+    def testAltIDBelowReparentedTerm(self):
+        newTerms = dict(BASE_TERMS)
+        newTerms["GO:0000002"] = (["GO:0000003"], [], True)
+        rebuilt = self.checkUpdate(newTerms)
+        self.assertEqual(rebuilt["Proteins"]["P4"]["Slims"], ["GO:0008150", "GO:0000002", "GO:0000003"])
+
+if __name__ == "__main__":
+    unittest.main()